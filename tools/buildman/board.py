@@ -2,6 +2,7 @@
 # Copyright (c) 2012 The Chromium OS Authors.
 
 from collections import OrderedDict
+import functools
 import re
 
 class Expr:
@@ -15,6 +16,9 @@ class Expr:
         """
         self._expr = expr
         self._re = re.compile(expr)
+        # Most expressions are plain words (e.g. 'arm'), which can be
+        # matched without going through the regular expression engine
+        self._literal = expr if re.escape(expr) == expr else None
 
     def Matches(self, props):
         """Check if any of the properties match the regular expression.
@@ -24,14 +28,51 @@ class Expr:
         Returns:
            True if any of the properties match the regular expression
         """
+        literal = self._literal
+        if literal is not None:
+            for prop in props:
+                if prop.startswith(literal):
+                    return True
+            return False
+
+        match = self._re.match
         for prop in props:
-            if self._re.match(prop):
+            if match(prop):
                 return True
         return False
 
+    def CanCombine(self):
+        """Check if the expression can be combined with others
+
+        Combining would renumber any capturing groups and so break
+        backreferences to them. Inline global flags such as (?i) would
+        apply to the whole combined expression on older Pythons, changing
+        how the other expressions match.
+
+        Returns:
+            True if the expression has no capturing groups and no flags
+            other than the defaults
+        """
+        return (not self._re.groups and
+                self._re.flags == re.compile('').flags)
+
     def __str__(self):
         return self._expr
 
+@functools.lru_cache(maxsize=None)
+def _MakeExpr(expr):
+    """Get an Expr object for a regular expression
+
+    Identical expressions share the same Expr object, so each one is only
+    compiled once.
+
+    Args:
+        expr: String containing regular expression
+    Returns:
+        Expr object
+    """
+    return Expr(expr)
+
 class Term:
     """A list of expressions each of which must match with properties.
 
@@ -49,7 +90,7 @@ class Term:
             expr: New Expr object to add to the list of those that must
                   match for a board to be built.
         """
-        self._expr_list.append(Expr(expr))
+        self._expr_list.append(_MakeExpr(expr))
 
     def __str__(self):
         """Return some sort of useful string describing the term"""
@@ -100,8 +141,8 @@ class Board:
 class Boards:
     """Manage a list of boards."""
     def __init__(self):
-        # Use a simple list here, sinc OrderedDict requires Python 2.7
-        self._boards = []
+        # Boards keyed by target, in the order they were added
+        self._boards = OrderedDict()
 
     def AddBoard(self, board):
         """Add a new board to the list.
@@ -111,7 +152,7 @@ class Boards:
         Args:
             board: board to add
         """
-        self._boards.append(board)
+        self._boards[board.target] = board
 
     def ReadBoards(self, fname):
         """Read a list of boards from a board file.
@@ -125,16 +166,13 @@ class Boards:
             for line in fd:
                 if line[0] == '#':
                     continue
-                fields = line.split()
+                # Only the first eight fields are used, so don't bother
+                # splitting up the maintainers at the end of the line
+                fields = [field if field != '-' else ''
+                          for field in line.split(None, 8)[:8]]
                 if not fields:
                     continue
-                for upto in range(len(fields)):
-                    if fields[upto] == '-':
-                        fields[upto] = ''
-                while len(fields) < 8:
-                    fields.append('')
-                if len(fields) > 8:
-                    fields = fields[:8]
+                fields.extend([''] * (8 - len(fields)))
 
                 board = Board(*fields)
                 self.AddBoard(board)
@@ -146,7 +184,7 @@ class Boards:
         Returns:
             List of Board objects
         """
-        return self._boards
+        return list(self._boards.values())
 
     def GetDict(self):
         """Build a dictionary containing all the boards.
@@ -156,10 +194,7 @@ class Boards:
                 key is board.target
                 value is board
         """
-        board_dict = OrderedDict()
-        for board in self._boards:
-            board_dict[board.target] = board
-        return board_dict
+        return OrderedDict(self._boards)
 
     def GetSelectedDict(self):
         """Return a dictionary containing the selected boards
@@ -168,7 +203,7 @@ class Boards:
             List of Board objects that are marked selected
         """
         board_dict = OrderedDict()
-        for board in self._boards:
+        for board in self._boards.values():
             if board.build_it:
                 board_dict[board.target] = board
         return board_dict
@@ -179,7 +214,7 @@ class Boards:
         Returns:
             List of Board objects that are marked selected
         """
-        return [board for board in self._boards if board.build_it]
+        return [board for board in self._boards.values() if board.build_it]
 
     def GetSelectedNames(self):
         """Return a list of selected boards
@@ -187,9 +222,12 @@ class Boards:
         Returns:
             List of board names that are marked selected
         """
-        return [board.target for board in self._boards if board.build_it]
+        return [board.target for board in self._boards.values()
+                if board.build_it]
 
-    def _BuildTerms(self, args):
+    @staticmethod
+    @functools.lru_cache(maxsize=128)
+    def _BuildTerms(args):
         """Convert command line arguments to a list of terms.
 
         This deals with parsing of the arguments. It handles the '&'
@@ -206,10 +244,13 @@ class Boards:
         The first Term has two expressions, both of which must match for
         a board to be selected.
 
+        The result is cached, so that the same arguments are only parsed
+        once.
+
         Args:
-            args: List of command line arguments
+            args: Tuple of command line arguments
         Returns:
-            A list of Term objects
+            A tuple of Term objects
         """
         syms = []
         for arg in args:
@@ -236,7 +277,30 @@ class Boards:
                 term.AddExpr(sym)
         if term:
             terms.append(term)
-        return terms
+        return tuple(terms)
+
+    def _CombineExprs(self, exprs):
+        """Combine a list of expressions into one matching any of them
+
+        This allows a board's properties to be checked against all the
+        expressions with a single regular-expression match per property.
+
+        Args:
+            exprs: List of Expr objects
+        Returns:
+            List of Expr objects, containing either the single combined
+            expression, or the original expressions if they cannot be
+            combined
+        """
+        if len(exprs) < 2:
+            return exprs
+
+        if not all(expr.CanCombine() for expr in exprs):
+            return exprs
+        try:
+            return [_MakeExpr('|'.join('(?:%s)' % expr for expr in exprs))]
+        except re.error:
+            return exprs
 
     def SelectBoards(self, args, exclude=[], boards=None):
         """Mark boards selected based on args
@@ -262,7 +326,7 @@ class Boards:
         """
         result = OrderedDict()
         warnings = []
-        terms = self._BuildTerms(args)
+        terms = self._BuildTerms(tuple(args))
 
         result['all'] = []
         for term in terms:
@@ -270,10 +334,13 @@ class Boards:
 
         exclude_list = []
         for expr in exclude:
-            exclude_list.append(Expr(expr))
+            exclude_list.append(_MakeExpr(expr))
+        exclude_list = self._CombineExprs(exclude_list)
 
-        found = []
-        for board in self._boards:
+        if boards:
+            boards = set(boards)
+        found = set()
+        for board in self._boards.values():
             matching_term = None
             build_it = False
             if terms:
@@ -286,7 +353,7 @@ class Boards:
             elif boards:
                 if board.target in boards:
                     build_it = True
-                    found.append(board.target)
+                    found.add(board.target)
             else:
                 build_it = True
 
@@ -303,7 +370,7 @@ class Boards:
                 result['all'].append(board.target)
 
         if boards:
-            remaining = set(boards) - set(found)
+            remaining = boards - found
             if remaining:
                 warnings.append('Boards not found: %s\n' % ', '.join(remaining))
 
@@ -517,6 +517,39 @@ class TestBuild(unittest.TestCase):
                          ({'all': ['board2', 'board3'],
                           'T.*r&^Po': ['board2', 'board3']}, []))
 
+    def testBoardPrefix(self):
+        """Test that a plain word matches the start of a property"""
+        self.assertEqual(self.boards.SelectBoards(['power']),
+                         ({'all': ['board2', 'board3'],
+                          'power': ['board2', 'board3']}, []))
+
+    def testBoardExclude(self):
+        """Test excluding boards with several expressions"""
+        self.assertEqual(self.boards.SelectBoards(['arm', 'powerpc'],
+                                                  ['board0', 'mpc8.x']),
+                         ({'all': ['board1', 'board2'],
+                          'arm': ['board1'],
+                          'powerpc': ['board2']}, []))
+
+    def testBoardExcludeFlags(self):
+        """Test that inline flags in one exclude don't affect the others"""
+        self.assertEqual(self.boards.SelectBoards([], ['(?i)BOARD0', 'tester']),
+                         ({'all': ['board1', 'board2', 'board3', 'board4']},
+                          []))
+
+    def testBoardList(self):
+        """Test selecting an explicit list of boards"""
+        self.assertEqual(self.boards.SelectBoards([], [], ['board2', 'board9']),
+                         ({'all': ['board2']},
+                          ['Boards not found: board9\n']))
+
+    def testBoardSelectTwice(self):
+        """Test that selecting with the same terms again gives the same result"""
+        expected = ({'all': ['board0', 'board1'],
+                     'Tester&arm': ['board0', 'board1']}, [])
+        self.assertEqual(self.boards.SelectBoards(['Tester & arm']), expected)
+        self.assertEqual(self.boards.SelectBoards(['Tester & arm']), expected)
+
     def testBoardDuplicate(self):
         """Test single board selection"""
         self.assertEqual(self.boards.SelectBoards(['sandbox sandbox',
@@ -12,22 +12,22 @@ Run 'tools/genboardscfg.py' to create a board database.
 Run 'tools/genboardscfg.py -h' for available options.
 """
 
+import concurrent.futures
 import errno
 import fnmatch
-import glob
 import multiprocessing
 import optparse
 import os
+import re
 import sys
 import tempfile
-import time
+import threading
 
 from buildman import kconfiglib
 
 ### constant variables ###
 OUTPUT_FILE = 'boards.cfg'
 CONFIG_DIR = 'configs'
-SLEEP_TIME = 0.03
 COMMENT_BLOCK = '''#
 # List of boards
 #   Automatically generated by %s: don't edit
@@ -52,15 +52,97 @@ def check_top_directory():
         if not os.path.exists(f):
             sys.exit('Please run at the top of source directory.')
 
+def _iter_files(root, predicate):
+    """Find the files under a directory whose names match a predicate.
+
+    The directory tree is traversed with os.scandir(), so callers can use
+    the stat result cached in each directory entry.
+
+    Arguments:
+      root: The top of the directory tree to be traversed
+      predicate: Function taking a file name and returning True if the
+                 file should be included
+
+    Yields:
+      An os.DirEntry object for each matching file
+    """
+    dirs = [root]
+    while dirs:
+        try:
+            it = os.scandir(dirs.pop())
+        except OSError:
+            # Skip directories which cannot be scanned, as os.walk() does
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif predicate(entry.name):
+                    yield entry
+
+def _is_defconfig(name):
+    """Check if a file name is that of a defconfig file."""
+    return name.endswith('_defconfig') and not name.startswith('.')
+
+def _is_kconfig_or_maintainers(name):
+    """Check if a file name is that of a Kconfig or MAINTAINERS file."""
+    return (name == 'MAINTAINERS' or
+            name.startswith('Kconfig') and not name.endswith('~'))
+
+def _iter_defconfigs(root):
+    """Find all the defconfig files under a directory.
+
+    Arguments:
+      root: The top of the directory tree to be traversed
+
+    Yields:
+      An os.DirEntry object for each defconfig file
+    """
+    return _iter_files(root, _is_defconfig)
+
+def _any_newer(entries, mtime, stop):
+    """Check if any of the given files was modified after a given time.
+
+    Arguments:
+      entries: An iterable of os.DirEntry objects
+      mtime: The modification time to compare against, in nanoseconds
+      stop: A threading.Event which is set to abandon the check
+
+    Returns:
+      True if a file with a newer mtime is found or the check was
+      abandoned, else False.
+    """
+    return any(stop.is_set() or mtime < entry.stat().st_mtime_ns
+               for entry in entries)
+
+def _defconfigs_newer(mtime, stop, defconfigs):
+    """Check if any defconfig file was modified after a given time.
+
+    Arguments:
+      mtime: The modification time to compare against, in nanoseconds
+      stop: A threading.Event which is set to abandon the check
+      defconfigs: A set to which the names of the defconfig files are added
+
+    Returns:
+      True if a newer defconfig file is found or the check was abandoned,
+      else False.
+    """
+    for entry in _iter_defconfigs(CONFIG_DIR):
+        if stop.is_set() or mtime < entry.stat().st_mtime_ns:
+            return True
+        defconfigs.add(entry.name)
+    return False
+
 def output_is_new(output):
     """Check if the output file is up to date.
 
     Returns:
-      True if the given output file exists and is newer than any of
-      *_defconfig, MAINTAINERS and Kconfig*.  False otherwise.
+      True if the given output file exists, is newer than any of
+      *_defconfig, MAINTAINERS and Kconfig*, and lists exactly the boards
+      which have a defconfig.  False otherwise.
     """
     try:
-        ctime = os.path.getctime(output)
+        mtime = os.stat(output).st_mtime_ns
     except OSError as exception:
         if exception.errno == errno.ENOENT:
             # return False on 'No such file or directory' error
@@ -68,35 +150,35 @@ def output_is_new(output):
         else:
             raise
 
-    for (dirpath, dirnames, filenames) in os.walk(CONFIG_DIR):
-        for filename in fnmatch.filter(filenames, '*_defconfig'):
-            if fnmatch.fnmatch(filename, '.*'):
-                continue
-            filepath = os.path.join(dirpath, filename)
-            if ctime < os.path.getctime(filepath):
-                return False
-
-    for (dirpath, dirnames, filenames) in os.walk('.'):
-        for filename in filenames:
-            if (fnmatch.fnmatch(filename, '*~') or
-                not fnmatch.fnmatch(filename, 'Kconfig*') and
-                not filename == 'MAINTAINERS'):
-                continue
-            filepath = os.path.join(dirpath, filename)
-            if ctime < os.path.getctime(filepath):
-                return False
-
-    # Detect a board that has been removed since the current board database
-    # was generated
+    # Both checks are mostly waiting for stat() and scandir() calls, so
+    # run them in parallel and stop as soon as one finds a newer file
+    defconfigs = set()
+    stop = threading.Event()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        try:
+            futures = [
+                executor.submit(_defconfigs_newer, mtime, stop, defconfigs),
+                executor.submit(_any_newer,
+                                _iter_files('.', _is_kconfig_or_maintainers),
+                                mtime, stop)]
+            for future in concurrent.futures.as_completed(futures):
+                if future.result():
+                    return False
+        finally:
+            # Let a check which is still running finish early
+            stop.set()
+
+    # Detect a board that has been added or removed since the current board
+    # database was generated. A new defconfig may keep an old mtime (e.g.
+    # after mv, cp -p or tar), so this cannot be left to the checks above.
+    targets = set()
     with open(output, encoding="utf-8") as f:
         for line in f:
             if line[0] == '#' or line == '\n':
                 continue
-            defconfig = line.split()[6] + '_defconfig'
-            if not os.path.exists(os.path.join(CONFIG_DIR, defconfig)):
-                return False
+            targets.add(line.split()[6] + '_defconfig')
 
-    return True
+    return targets == defconfigs
 
 ### classes ###
 class KconfigScanner:
@@ -121,6 +203,10 @@ class KconfigScanner:
         os.environ['UBOOTVERSION'] = 'dummy'
         os.environ['KCONFIG_OBJDIR'] = ''
         self._conf = kconfiglib.Kconfig(warn=False)
+        # The symbol objects stay the same while loading defconfigs, so
+        # look them up only once
+        self._sym_objs = tuple((key, self._conf.syms[symbol])
+                               for key, symbol in self._SYMBOL_TABLE.items())
 
     def __del__(self):
         """Delete a leftover temporary file before exit.
@@ -152,34 +238,37 @@ class KconfigScanner:
               'options': <extra_options>
           }
         """
-        # strip special prefixes and save it in a temporary file
-        fd, self._tmpfile = tempfile.mkstemp()
-        with os.fdopen(fd, 'w') as f:
-            for line in open(defconfig):
-                colon = line.find(':CONFIG_')
-                if colon == -1:
-                    f.write(line)
-                else:
-                    f.write(line[colon + 1:])
-
-        self._conf.load_config(self._tmpfile)
-        try_remove(self._tmpfile)
-        self._tmpfile = None
-
-        params = {}
+        with open(defconfig) as f:
+            lines = f.readlines()
+
+        if not any(':CONFIG_' in line for line in lines):
+            # Nothing to strip, so load the file as it is. Kconfiglib only
+            # recalculates the symbols whose values differ from the
+            # previously loaded defconfig.
+            self._conf.load_config(defconfig)
+        else:
+            # strip special prefixes and save it in a temporary file
+            fd, self._tmpfile = tempfile.mkstemp()
+            with os.fdopen(fd, 'w') as f:
+                for line in lines:
+                    colon = line.find(':CONFIG_')
+                    if colon == -1:
+                        f.write(line)
+                    else:
+                        f.write(line[colon + 1:])
+
+            self._conf.load_config(self._tmpfile)
+            try_remove(self._tmpfile)
+            self._tmpfile = None
 
         # Get the value of CONFIG_SYS_ARCH, CONFIG_SYS_CPU, ... etc.
         # Set '-' if the value is empty.
-        for key, symbol in list(self._SYMBOL_TABLE.items()):
-            value = self._conf.syms.get(symbol).str_value
-            if value:
-                params[key] = value
-            else:
-                params[key] = '-'
+        params = {key: sym.str_value or '-' for key, sym in self._sym_objs}
 
         defconfig = os.path.basename(defconfig)
-        params['target'], match, rear = defconfig.partition('_defconfig')
+        target, match, rear = defconfig.partition('_defconfig')
         assert match and not rear, '%s : invalid defconfig' % defconfig
+        params['target'] = target
 
         # fix-up for aarch64
         if params['arch'] == 'arm' and params['cpu'] == 'armv8':
@@ -187,34 +276,33 @@ class KconfigScanner:
 
         # fix-up options field. It should have the form:
         # <config name>[:comma separated config options]
-        if params['options'] != '-':
-            params['options'] = params['config'] + ':' + \
-                                params['options'].replace(r'\"', '"')
-        elif params['config'] != params['target']:
-            params['options'] = params['config']
+        config = params['config']
+        options = params['options']
+        if options != '-':
+            params['options'] = config + ':' + options.replace(r'\"', '"')
+        elif config != target:
+            params['options'] = config
 
         return params
 
-def scan_defconfigs_for_multiprocess(queue, defconfigs):
-    """Scan defconfig files and queue their board parameters
+# The KconfigScanner of a worker process, created on first use
+_kconf_scanner = None
+
+def scan_defconfig_for_multiprocess(defconfig):
+    """Scan a defconfig file and return its board parameters
 
     This function is intended to be passed to
-    multiprocessing.Process() constructor.
+    multiprocessing.Pool.imap_unordered(). Each worker process parses
+    the Kconfig files only once, when it scans its first defconfig. Any
+    error while doing so is passed back to the parent process.
 
     Arguments:
-      queue: An instance of multiprocessing.Queue().
-             The resulting board parameters are written into it.
-      defconfigs: A sequence of defconfig files to be scanned.
+      defconfig: path to the defconfig file to be processed
     """
-    kconf_scanner = KconfigScanner()
-    for defconfig in defconfigs:
-        queue.put(kconf_scanner.scan(defconfig))
-
-def read_queues(queues, params_list):
-    """Read the queues and append the data to the paramers list"""
-    for q in queues:
-        while not q.empty():
-            params_list.append(q.get())
+    global _kconf_scanner
+    if _kconf_scanner is None:
+        _kconf_scanner = KconfigScanner()
+    return _kconf_scanner.scan(defconfig)
 
 def scan_defconfigs(jobs=1):
     """Collect board parameters for all defconfig files.
@@ -224,43 +312,18 @@ def scan_defconfigs(jobs=1):
     Arguments:
       jobs: The number of jobs to run simultaneously
     """
-    all_defconfigs = []
-    for (dirpath, dirnames, filenames) in os.walk(CONFIG_DIR):
-        for filename in fnmatch.filter(filenames, '*_defconfig'):
-            if fnmatch.fnmatch(filename, '.*'):
-                continue
-            all_defconfigs.append(os.path.join(dirpath, filename))
-
-    total_boards = len(all_defconfigs)
-    processes = []
-    queues = []
-    for i in range(jobs):
-        defconfigs = all_defconfigs[total_boards * i // jobs :
-                                    total_boards * (i + 1) // jobs]
-        q = multiprocessing.Queue(maxsize=-1)
-        p = multiprocessing.Process(target=scan_defconfigs_for_multiprocess,
-                                    args=(q, defconfigs))
-        p.start()
-        processes.append(p)
-        queues.append(q)
+    all_defconfigs = [entry.path for entry in _iter_defconfigs(CONFIG_DIR)]
 
     # The resulting data should be accumulated to this list
     params_list = []
 
-    # Data in the queues should be retrieved preriodically.
-    # Otherwise, the queues would become full and subprocesses would get stuck.
-    while any([p.is_alive() for p in processes]):
-        read_queues(queues, params_list)
-        # sleep for a while until the queues are filled
-        time.sleep(SLEEP_TIME)
-
-    # Joining subprocesses just in case
-    # (All subprocesses should already have been finished)
-    for p in processes:
-        p.join()
-
-    # retrieve leftover data
-    read_queues(queues, params_list)
+    # Hand out the defconfigs in several chunks per worker so that the
+    # load stays balanced without paying the IPC cost for each of them
+    chunksize = max(1, len(all_defconfigs) // (jobs * 4))
+    with multiprocessing.Pool(jobs) as pool:
+        for params in pool.imap_unordered(scan_defconfig_for_multiprocess,
+                                          all_defconfigs, chunksize):
+            params_list.append(params)
 
     return params_list
 
@@ -268,9 +331,43 @@ class MaintainersDatabase:
 
     """The database of board status and maintainers."""
 
-    def __init__(self):
-        """Create an empty database."""
+    def __init__(self, defconfigs=frozenset()):
+        """Create an empty database.
+
+        Arguments:
+          defconfigs: A set of the paths to all defconfig files, relative
+                      to the top of the source tree (e.g. configs/foo_defconfig)
+        """
         self.database = {}
+        self._defconfigs = defconfigs
+
+    def _expand_defconfigs(self, pattern):
+        """Find the defconfig files which match a wildcard pattern.
+
+        This gives the same result as filtering glob.glob(pattern) by
+        'configs/*_defconfig', but only looks at the known defconfig files
+        instead of the file system.
+
+        Arguments:
+          pattern: The wildcard pattern given by an 'F:' tag
+
+        Returns:
+          A list of the paths to the matching defconfig files.
+        """
+        if not any(c in pattern for c in '*?['):
+            return [pattern] if pattern in self._defconfigs else []
+
+        # Like glob, match each path component separately so that '*'
+        # does not match across directories
+        matchers = [re.compile(fnmatch.translate(part)).match
+                    for part in pattern.split('/')]
+        found = []
+        for defconfig in self._defconfigs:
+            parts = defconfig.split('/')
+            if (len(parts) == len(matchers) and
+                all(match(part) for match, part in zip(matchers, parts))):
+                found.append(defconfig)
+        return found
 
     def get_status(self, target):
         """Return the status of the given board.
@@ -325,21 +422,17 @@ class MaintainersDatabase:
         status = '-'
         for line in open(file, encoding="utf-8"):
             # Check also commented maintainers
-            if line[:3] == '#M:':
+            if line.startswith('#M:'):
                 line = line[1:]
-            tag, rest = line[:2], line[2:].strip()
-            if tag == 'M:':
-                maintainers.append(rest)
-            elif tag == 'F:':
+            # Only slice the line once the tag is known to be of interest
+            if line.startswith('M:'):
+                maintainers.append(line[2:].strip())
+            elif line.startswith('F:'):
                 # expand wildcard and filter by 'configs/*_defconfig'
-                for f in glob.glob(rest):
-                    front, match, rear = f.partition('configs/')
-                    if not front and match:
-                        front, match, rear = rear.rpartition('_defconfig')
-                        if match and not rear:
-                            targets.append(front)
-            elif tag == 'S:':
-                status = rest
+                for f in self._expand_defconfigs(line[2:].strip()):
+                    targets.append(f[len('configs/'):-len('_defconfig')])
+            elif line.startswith('S:'):
+                status = line[2:].strip()
             elif line == '\n':
                 for target in targets:
                     self.database[target] = (status, maintainers)
@@ -350,16 +443,59 @@ class MaintainersDatabase:
             for target in targets:
                 self.database[target] = (status, maintainers)
 
-def insert_maintainers_info(params_list):
+def init_maintainers_worker(defconfigs):
+    """Set up a worker process for parsing MAINTAINERS files
+
+    This function is intended to be passed to multiprocessing.Pool() as
+    its initializer, so the set of defconfig files is only sent once to
+    each worker.
+
+    Arguments:
+      defconfigs: A set of the paths to all defconfig files
+    """
+    global _defconfigs
+    _defconfigs = defconfigs
+
+def parse_maintainers_for_multiprocess(fname):
+    """Parse a MAINTAINERS file and return the resulting database
+
+    This function is intended to be passed to
+    multiprocessing.Pool.map().
+
+    Arguments:
+      fname: MAINTAINERS file to be parsed
+
+    Returns:
+      The database dictionary of a MaintainersDatabase which has
+      parsed the given file.
+    """
+    database = MaintainersDatabase(_defconfigs)
+    database.parse_file(fname)
+    return database.database
+
+def insert_maintainers_info(params_list, jobs=1):
     """Add Status and Maintainers information to the board parameters list.
 
+    MAINTAINERS files are parsed in parallel.  The results are merged in
+    the order the files were found so that the outcome is the same as
+    parsing them one by one.
+
     Arguments:
       params_list: A list of the board parameters
+      jobs: The number of jobs to run simultaneously
     """
+    files = [os.path.join(dirpath, 'MAINTAINERS')
+             for (dirpath, dirnames, filenames) in os.walk('.')
+             if 'MAINTAINERS' in filenames]
+
+    defconfigs = frozenset(entry.path
+                           for entry in _iter_defconfigs(CONFIG_DIR))
+
     database = MaintainersDatabase()
-    for (dirpath, dirnames, filenames) in os.walk('.'):
-        if 'MAINTAINERS' in filenames:
-            database.parse_file(os.path.join(dirpath, 'MAINTAINERS'))
+    with multiprocessing.Pool(jobs, initializer=init_maintainers_worker,
+                              initargs=(defconfigs,)) as pool:
+        for result in pool.map(parse_maintainers_for_multiprocess, files):
+            database.database.update(result)
 
     for i, params in enumerate(params_list):
         target = params['target']
@@ -380,25 +516,24 @@ def format_and_output(params_list, output):
     FIELDS = ('status', 'arch', 'cpu', 'soc', 'vendor', 'board', 'target',
               'options', 'maintainers')
 
-    # First, decide the width of each column
-    max_length = dict([ (f, 0) for f in FIELDS])
+    # Collect the fields and decide the width of each column in one pass
+    rows = []
+    max_length = [0] * len(FIELDS)
     for params in params_list:
-        for f in FIELDS:
-            max_length[f] = max(max_length[f], len(params[f]))
+        row = tuple(params[f] for f in FIELDS)
+        max_length = [max(m, len(v)) for m, v in zip(max_length, row)]
+        rows.append(row)
 
-    output_lines = []
-    for params in params_list:
-        line = ''
-        for f in FIELDS:
-            # insert two spaces between fields like column -t would
-            line += '  ' + params[f].ljust(max_length[f])
-        output_lines.append(line.strip())
+    # insert two spaces between fields like column -t would
+    fmt = '  '.join('%%-%ds' % width for width in max_length)
+    output_lines = [(fmt % row).strip() for row in rows]
 
     # ignore case when sorting
     output_lines.sort(key=str.lower)
 
     with open(output, 'w', encoding="utf-8") as f:
-        f.write(COMMENT_BLOCK + '\n'.join(output_lines) + '\n')
+        f.write(COMMENT_BLOCK)
+        f.writelines(line + '\n' for line in output_lines)
 
 def gen_boards_cfg(output, jobs=1, force=False, quiet=False):
     """Generate a board database file.
@@ -417,7 +552,7 @@ def gen_boards_cfg(output, jobs=1, force=False, quiet=False):
         sys.exit(0)
 
     params_list = scan_defconfigs(jobs)
-    insert_maintainers_info(params_list)
+    insert_maintainers_info(params_list, jobs)
     format_and_output(params_list, output)
 
 def main():